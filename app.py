@@ -1,244 +1,496 @@
 # app.py
+import hashlib
+import io
 import os
+import re
 import threading
 import logging
-import pytz
 import time
-from datetime import datetime, timedelta
-from urllib.parse import parse_qs, urlparse
-import pandas as pd
-from flask import Flask, render_template, send_file, request, redirect, url_for, flash
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from zoneinfo import ZoneInfo
+import httpx
+from apscheduler.schedulers.background import BackgroundScheduler
+from cachetools import TTLCache
+from flask import Flask, render_template, make_response, send_file, request, session, redirect, url_for, flash
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
+import orjson
 import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON (and |tojson) through orjson; output is always compact."""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS if kwargs.get("sort_keys", self.sort_keys) else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+# The dashboard's inline tables and chart data compress ~10x
+Compress(app)
+# orjson serialises the chart data islands (|tojson) several times faster
+app.json = ORJSONProvider(app)
 
 # Logging
-logging.basicConfig(level=logging.INFO,
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
                     format='%(asctime)s %(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+IST = ZoneInfo("Asia/Kolkata")
+
 # YouTube API
 API_KEY = os.getenv("YOUTUBE_API_KEY")
-youtube = build("youtube", "v3", developerKey=API_KEY) if API_KEY else None
+# One long-lived HTTP/2 client: polls reuse the TLS connection to googleapis.com
+# and concurrent chunk requests multiplex over it
+youtube = httpx.Client(
+    base_url="https://www.googleapis.com/youtube/v3",
+    params={"key": API_KEY},
+    timeout=10.0,
+    http2=True,
+) if API_KEY else None
+YT_MAX_IDS = 50  # videos.list accepts at most 50 ids per call
+_api_pool = ThreadPoolExecutor(max_workers=4)
+
+# Titles barely change; stats only dedupe add_video lookups (the poll bypasses
+# the cache and refreshes it)
+_title_cache = TTLCache(maxsize=1024, ttl=24 * 3600)
+_stats_cache = TTLCache(maxsize=1024, ttl=240)
+# Dashboard payload; cleared on every write from this process, expires for the rest
+_index_cache = TTLCache(maxsize=1, ttl=60)
+_cache_lock = threading.Lock()
 
 # PostgreSQL
 POSTGRES_URL = os.getenv("DATABASE_URL",
     "postgresql://ytanalysis_db_user:Uqy7UPp7lOfu1sEHvVOKlWwozrhpZzCk@"
     "dpg-d46am6q4d50c73cgrkv0-a.oregon-postgres.render.com/ytanalysis_db")
 
-db_conn = None
-_background_thread = None
-
-def get_db():
-    global db_conn
-    if db_conn is None or db_conn.closed:
-        db_conn = psycopg.connect(
-            POSTGRES_URL,
-            row_factory=dict_row,
-            keepalives=1,
-            keepalives_idle=30,
-            keepalives_interval=10,
-            keepalives_count=5,
-        )
-        db_conn.autocommit = True
-    return db_conn
+DB_KWARGS = {
+    "row_factory": dict_row,
+    "autocommit": True,
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 5,
+    # Dates and displayed timestamps are IST wall-clock
+    "options": "-c timezone=Asia/Kolkata",
+}
+pool = ConnectionPool(POSTGRES_URL, min_size=2, max_size=10, kwargs=DB_KWARGS, open=True)
+_scheduler = None
+# Advisory lock ids: schema setup, poll leadership across gunicorn workers,
+# and the one-off gains backfill
+INIT_LOCK_ID = 727001
+POLL_LOCK_ID = 727002
+BACKFILL_LOCK_ID = 727003
+_poll_conn = None
+_poll_leader = False
+
+@contextmanager
+def get_db_cursor():
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
 
 def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS views (
-            video_id TEXT NOT NULL,
-            date DATE NOT NULL,
-            timestamp TEXT NOT NULL,
-            views BIGINT NOT NULL,
-            likes BIGINT NOT NULL,
-            PRIMARY KEY (video_id, timestamp)
-        );
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS video_list (
-            video_id TEXT PRIMARY KEY,
-            name TEXT,
-            is_tracking INTEGER DEFAULT 1
-        );
-    """)
+    # Runs once per deploy (gunicorn's master, or python app.py); the lock
+    # serialises the DDL if two deploys or instances overlap
+    with get_db_cursor() as cur, cur.connection.transaction():
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (INIT_LOCK_ID,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS views (
+                video_id TEXT NOT NULL,
+                date DATE NOT NULL,
+                timestamp TIMESTAMPTZ NOT NULL,
+                views BIGINT NOT NULL,
+                likes BIGINT NOT NULL,
+                PRIMARY KEY (video_id, timestamp)
+            );
+        """)
+        # Older deployments stored IST wall-clock text; convert in place once
+        cur.execute("""
+            DO $$
+            BEGIN
+                IF (SELECT data_type FROM information_schema.columns
+                    WHERE table_name = 'views' AND column_name = 'timestamp') = 'text' THEN
+                    ALTER TABLE views ALTER COLUMN timestamp TYPE TIMESTAMPTZ
+                        USING timestamp::timestamp AT TIME ZONE 'Asia/Kolkata';
+                END IF;
+            END $$;
+        """)
+        # Hypertable with 1-day chunks where the server offers TimescaleDB;
+        # a savepoint keeps a failed setup from aborting the rest of init
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'")
+        if cur.fetchone():
+            try:
+                with cur.connection.transaction():
+                    cur.execute("CREATE EXTENSION IF NOT EXISTS timescaledb")
+                    cur.execute("""
+                        SELECT create_hypertable('views', 'timestamp',
+                            chunk_time_interval => interval '1 day',
+                            if_not_exists => TRUE, migrate_data => TRUE);
+                    """)
+                    # Compressed chunks take UPDATE/DELETE (remove(), late re-polls,
+                    # column backfills) only from TimescaleDB 2.11 on; older
+                    # servers keep every chunk uncompressed
+                    cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'timescaledb'")
+                    version = tuple(int(p) for p in cur.fetchone()["extversion"].split(".")[:2])
+                    if version >= (2, 11):
+                        cur.execute("""
+                            SELECT compression_enabled FROM timescaledb_information.hypertables
+                            WHERE hypertable_name = 'views'
+                        """)
+                        if not cur.fetchone()["compression_enabled"]:
+                            cur.execute("""
+                                ALTER TABLE views SET (timescaledb.compress,
+                                    timescaledb.compress_segmentby = 'video_id',
+                                    timescaledb.compress_orderby = 'timestamp');
+                            """)
+                        cur.execute("SELECT add_compression_policy('views', interval '7 days', if_not_exists => TRUE)")
+                    else:
+                        cur.execute("SELECT remove_compression_policy('views', if_exists => TRUE)")
+                        cur.execute("""
+                            SELECT decompress_chunk(format('%I.%I', chunk_schema, chunk_name)::regclass)
+                            FROM timescaledb_information.chunks
+                            WHERE hypertable_name = 'views' AND is_compressed
+                        """)
+            except psycopg.Error as e:
+                logger.warning("TimescaleDB not enabled: %s", e)
+        # Serves the per-day gain look-backs as index-only scans. Checked first:
+        # even IF NOT EXISTS takes a SHARE lock that waits out the poller's writes
+        cur.execute("SELECT to_regclass('idx_views_vid_date_ts') IS NOT NULL AS found")
+        if not cur.fetchone()["found"]:
+            cur.execute("""
+                CREATE INDEX idx_views_vid_date_ts
+                ON views (video_id, date, timestamp) INCLUDE (views, likes);
+            """)
+        # Gains are filled in at write time so reads are a plain SELECT:
+        #   gain_5min    vs previous sample (same day)
+        #   gain_hourly  vs latest sample <= ts - 1 hour (same day)
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'views' AND column_name = 'gain_5min'
+        """)
+        # Existing rows are filled in by backfill_gains, off the startup path
+        if not cur.fetchone():
+            cur.execute("""
+                ALTER TABLE views ADD COLUMN gain_5min BIGINT, ADD COLUMN gain_hourly BIGINT;
+            """)
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION views_set_gains() RETURNS trigger AS $$
+            BEGIN
+                NEW.gain_5min := NEW.views - COALESCE((
+                    SELECT views FROM views
+                    WHERE video_id = NEW.video_id AND date = NEW.date
+                      AND timestamp < NEW.timestamp
+                    ORDER BY timestamp DESC LIMIT 1), NEW.views);
+                NEW.gain_hourly := NEW.views - COALESCE((
+                    SELECT views FROM views
+                    WHERE video_id = NEW.video_id AND date = NEW.date
+                      AND timestamp <= NEW.timestamp - interval '1 hour'
+                    ORDER BY timestamp DESC LIMIT 1), NEW.views);
+                RETURN NEW;
+            END $$ LANGUAGE plpgsql;
+        """)
+        # UPDATE OF views covers the ON CONFLICT path when a slot is re-polled.
+        # Created only once: CREATE TRIGGER locks views against the live poller
+        cur.execute("SELECT 1 FROM pg_trigger WHERE tgrelid = 'views'::regclass AND tgname = 'views_gains'")
+        if not cur.fetchone():
+            cur.execute("""
+                CREATE TRIGGER views_gains BEFORE INSERT OR UPDATE OF views ON views
+                FOR EACH ROW EXECUTE FUNCTION views_set_gains();
+            """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS video_list (
+                video_id TEXT PRIMARY KEY,
+                name TEXT,
+                is_tracking INTEGER DEFAULT 1
+            );
+        """)
     logger.info("Tables ready")
 
+@app.cli.command("init-db")
+def init_db_command():
+    """Create or migrate the schema; gunicorn runs this before starting workers."""
+    init_db()
+
+def backfill_gains():
+    """Fill gain_5min/gain_hourly on samples stored before the trigger existed,
+    one video per transaction so the poller only ever waits on that video's rows.
+    Returns True once a full pass is done; the trigger keeps new rows filled."""
+    with pool.connection() as conn:
+        # One worker does it; the rest skip
+        if not conn.execute("SELECT pg_try_advisory_lock(%s) AS ok", (BACKFILL_LOCK_ID,)).fetchone()["ok"]:
+            return False
+        try:
+            vids = [r["video_id"] for r in conn.execute("SELECT DISTINCT video_id FROM views WHERE gain_5min IS NULL")]
+            for vid in vids:
+                with conn.transaction():
+                    conn.execute("""
+                        UPDATE views v SET gain_5min = g.gain, gain_hourly = g.hourly
+                        FROM (
+                            SELECT v.video_id, v.timestamp,
+                                   COALESCE(v.views - LAG(v.views) OVER (
+                                       PARTITION BY v.date ORDER BY v.timestamp), 0) AS gain,
+                                   COALESCE(v.views - h.views, 0) AS hourly
+                            FROM views v
+                            LEFT JOIN LATERAL (
+                                SELECT views FROM views
+                                WHERE video_id = v.video_id AND date = v.date
+                                  AND timestamp <= v.timestamp - interval '1 hour'
+                                ORDER BY timestamp DESC LIMIT 1
+                            ) h ON true
+                            WHERE v.video_id = %s
+                        ) g
+                        WHERE v.video_id = g.video_id AND v.timestamp = g.timestamp
+                          AND v.gain_5min IS NULL
+                    """, (vid,))
+            if vids:
+                logger.info("Backfilled gains for %d videos", len(vids))
+                invalidate_index()
+            return True
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (BACKFILL_LOCK_ID,))
+
+# watch?v=, shorts/, embed/ and youtu.be/ links; ids are always 11 chars
+_VIDEO_ID_RE = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/)|youtu\.be/)([A-Za-z0-9_-]{11})")
+
 def extract_video_id(link):
-    parsed = urlparse(link)
-    if parsed.hostname in ("youtube.com", "www.youtube.com"):
-        return parse_qs(parsed.query).get("v", [None])[0]
-    if parsed.hostname == "youtu.be":
-        return parsed.path[1:] if len(parsed.path) > 1 else None
-    return None
+    m = _VIDEO_ID_RE.search(link)
+    return m.group(1) if m else None
 
-def fetch_video_title(vid):
-    if not youtube: return "Unknown"
-    try:
-        resp = youtube.videos().list(part="snippet", id=vid).execute()
-        return resp["items"][0]["snippet"]["title"][:50] if resp["items"] else "Unknown"
-    except:
-        return "Unknown"
+def list_videos(part, ids):
+    resp = youtube.get("/videos", params={"part": part, "id": ",".join(ids)})
+    resp.raise_for_status()
+    return orjson.loads(resp.content).get("items", [])
 
-def fetch_views(ids):
-    if not youtube or not ids: return {}
+def _fetch_stats_chunk(ids):
     try:
-        resp = youtube.videos().list(part="statistics", id=",".join(ids)).execute()
         return {item["id"]: {
             "views": int(item["statistics"].get("viewCount", 0)),
             "likes": int(item["statistics"].get("likeCount", 0))
-        } for item in resp.get("items", [])}
+        } for item in list_videos("statistics", ids)}
     except Exception as e:
-        logger.error(f"API error: {e}")
+        logger.error("API error: %s", e)
         return {}
 
+def fetch_video_title(vid):
+    if not youtube: return "Unknown"
+    with _cache_lock:
+        title = _title_cache.get(vid)
+    if title:
+        return title
+    try:
+        items = list_videos("snippet", [vid])
+        if not items:
+            return "Unknown"
+        title = items[0]["snippet"]["title"][:50]
+    except:
+        return "Unknown"
+    with _cache_lock:
+        _title_cache[vid] = title
+    return title
+
+def fetch_views(ids, use_cache=True):
+    """use_cache=False always asks the API (the poll must store live counts),
+    but still refreshes the cache for add_video."""
+    if not youtube or not ids: return {}
+    out = {}
+    if use_cache:
+        with _cache_lock:
+            for vid in ids:
+                stats = _stats_cache.get(vid)
+                if stats:
+                    out[vid] = stats
+    missing = [vid for vid in ids if vid not in out]
+    if not missing:
+        return out
+    # Chunks of 50 ids are requested concurrently, so the whole poll costs ~1 RTT
+    chunks = [missing[i:i + YT_MAX_IDS] for i in range(0, len(missing), YT_MAX_IDS)]
+    fresh = {}
+    for part in _api_pool.map(_fetch_stats_chunk, chunks):
+        fresh.update(part)
+    with _cache_lock:
+        _stats_cache.update(fresh)
+    out.update(fresh)
+    return out
+
 # CLEAN :00 TIMESTAMPS + NO DUPLICATES
-def safe_store(vid, stats):
-    cur = get_db().cursor()
-    ist = pytz.timezone("Asia/Kolkata")
-    now = datetime.now(ist)
-    
-    # Round down to nearest 5-minute mark → perfect :00
-    minute = now.minute - (now.minute % 5)
-    rounded = now.replace(minute=minute, second=0, microsecond=0)
-    ts = rounded.strftime("%Y-%m-%d %H:%M:00")
-    date = rounded.strftime("%Y-%m-%d")
-
-    cur.execute("DELETE FROM views WHERE video_id=%s AND timestamp=%s", (vid, ts))
-    cur.execute("""
+def store_views(cur, stats):
+    """stats: {video_id: {"views": int, "likes": int}}, written in one batch"""
+    if not stats:
+        return
+    # Round down to nearest 5-minute mark → perfect :00 (IST's +5:30 is a whole number of them)
+    ts = datetime.fromtimestamp(time.time() // 300 * 300, IST)
+
+    rows = [(vid, ts.date(), ts, s["views"], s["likes"]) for vid, s in stats.items()]
+    # executemany pipelines the batch: one round trip for every video
+    cur.executemany("""
         INSERT INTO views (video_id, date, timestamp, views, likes)
         VALUES (%s, %s, %s, %s, %s)
-    """, (vid, date, ts, stats["views"], stats["likes"]))
-    logger.info(f"STORED {vid} → {stats['views']:,} views @ {ts}")
+        ON CONFLICT (video_id, timestamp)
+        DO UPDATE SET views=EXCLUDED.views, likes=EXCLUDED.likes
+    """, rows)
+    stamp = ts.strftime("%Y-%m-%d %H:%M:%S")
+    logger.info("STORED %d videos @ %s", len(rows), stamp)
+    if logger.isEnabledFor(logging.DEBUG):
+        for vid, s in stats.items():
+            logger.debug("STORED %s → %s views @ %s", vid, f"{s['views']:,}", stamp)
+
+# The scheduler thread keeps one connection of its own: it holds the
+# session-level poll lock (one worker polls, another takes over on its next
+# tick if that worker dies) and does all of the poll's reads and writes
+def is_poll_leader():
+    global _poll_conn, _poll_leader
+    if _poll_conn is None or _poll_conn.closed:
+        # A lost connection took the lock with it
+        _poll_conn = psycopg.connect(POSTGRES_URL, **DB_KWARGS)
+        _poll_leader = False
+    # Session locks stack, so once held it is not taken again
+    if not _poll_leader:
+        _poll_leader = _poll_conn.execute(
+            "SELECT pg_try_advisory_lock(%s) AS leader", (POLL_LOCK_ID,)).fetchone()["leader"]
+    return _poll_leader
+
+def poll_once():
+    if not is_poll_leader():
+        return
+    conn = _poll_conn
+    ids = [r["video_id"] for r in conn.execute("SELECT video_id FROM video_list WHERE is_tracking=1")]
+    if not ids:
+        return
+    stats = fetch_views(ids, use_cache=False)
+    # One commit for the whole tick, acknowledged before its WAL flush; a
+    # database crash can cost at most this tick's samples, never consistency
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute("SET LOCAL synchronous_commit = off")
+        store_views(cur, stats)
+    invalidate_index()
+
+def backfill_job():
+    if backfill_gains():
+        _scheduler.remove_job("backfill_gains")
 
-# SINGLETON BACKGROUND TASK
+# SINGLETON BACKGROUND TASK — fires on every :00/:05/... IST mark
 def start_background():
-    global _background_thread
-    if _background_thread:
+    global _scheduler
+    if _scheduler:
         return
-    def run():
-        while True:
-            try:
-                now = datetime.now(pytz.timezone("Asia/Kolkata"))
-                # Sleep until next 5-min mark
-                wait = 300 - (now.minute % 5 * 60 + now.second)
-                if wait <= 0: wait += 300
-                time.sleep(wait)
-
-                cur = get_db().cursor()
-                cur.execute("SELECT video_id FROM video_list WHERE is_tracking=1")
-                ids = [r["video_id"] for r in cur.fetchall()]
-                if ids:
-                    stats = fetch_views(ids)
-                    for vid in ids:
-                        if vid in stats:
-                            safe_store(vid, stats[vid])
-            except Exception as e:
-                logger.error(f"BG error: {e}")
-                time.sleep(60)
-    _background_thread = threading.Thread(target=run, daemon=True)
-    _background_thread.start()
+    _scheduler = BackgroundScheduler(timezone=IST)
+    # coalesce + max_instances=1: a slow poll is never overlapped or replayed
+    _scheduler.add_job(poll_once, "cron", minute="*/5", coalesce=True,
+                       max_instances=1, misfire_grace_time=60)
+    # Starts right away and retries every 10 minutes until a pass completes
+    _scheduler.add_job(backfill_job, "interval", minutes=10, id="backfill_gains",
+                       next_run_time=datetime.now(IST), coalesce=True, max_instances=1)
+    _scheduler.start()
     logger.info("Background task started")
 
-# 4 VALUES: timestamp, views, gain, hourly
-# 4 VALUES: timestamp, views, gain, hourly, pct_change_vs_prev24h
-def process_gains(vid, rows):
-    """
-    rows: list of dicts with keys 'timestamp', 'views', 'date'
-    Returns list of tuples: (ts, views, gain, hourly, pct_change)
-      pct_change is a float (positive means increase), or None if not computable.
-    """
-    if not rows:
-        return []
-    result = []
-    conn = get_db()
-    for i, row in enumerate(rows):
-        views = row["views"]
-        ts = row["timestamp"]          # string: "YYYY-MM-DD HH:MM:SS"
-        date = row["date"]             # date object or "YYYY-MM-DD"
-
-        # compute 5-min gain vs previous sample (same day)
-        gain = 0
-        if i > 0 and rows[i-1]["date"] == date:
-            gain = views - rows[i-1]["views"]
-
-        # compute hourly: find latest sample <= ts - 1 hour (same video, same day)
-        ts_dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-        one_ago = (ts_dt - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT views FROM views
-            WHERE video_id=%s AND date=%s AND timestamp <= %s
-            ORDER BY timestamp DESC LIMIT 1
-        """, (vid, date, one_ago))
-        prev = cur.fetchone()
-        hourly = views - prev["views"] if prev else 0
-
-        # --- NEW: compute prev 24h same-time 5-min gain ---
-        prev_date_dt = ts_dt.date() - timedelta(days=1)
-        # Build timestamp strings for prev date at same clock time, and minus 5 minutes
-        ts_prev = datetime.combine(prev_date_dt, ts_dt.time()).strftime("%Y-%m-%d %H:%M:%S")
-        ts_prev_minus5 = (datetime.combine(prev_date_dt, ts_dt.time()) - timedelta(minutes=5)).strftime("%Y-%m-%d %H:%M:%S")
-
-        # Fetch views at those two timestamps (we accept <= exact timestamp to be tolerant)
-        cur.execute("""
-            SELECT views FROM views
-            WHERE video_id=%s AND timestamp <= %s AND date=%s
-            ORDER BY timestamp DESC LIMIT 1
-        """, (vid, ts_prev, prev_date_dt.strftime("%Y-%m-%d")))
-        p1 = cur.fetchone()
+def load_videos():
+    videos = []
+    with get_db_cursor() as cur:
+        # One round trip for every video and sample:
+        #   gain, hourly  stored per sample by the views_gains trigger; rows
+        #                 backfill_gains hasn't reached yet fall back to the
+        #                 trigger's look-ups (COALESCE only runs them for NULLs)
+        #   prev_gain     previous day's 5-min gain at the same clock time
         cur.execute("""
-            SELECT views FROM views
-            WHERE video_id=%s AND timestamp <= %s AND date=%s
-            ORDER BY timestamp DESC LIMIT 1
-        """, (vid, ts_prev_minus5, prev_date_dt.strftime("%Y-%m-%d")))
-        p0 = cur.fetchone()
-
-        prev_gain = None
-        if p1 and p0:
-            # compute previous day's 5min gain
-            prev_gain = p1["views"] - p0["views"]
-
-        pct_change = None
-        try:
-            if prev_gain is not None and prev_gain != 0:
-                pct_change = (gain - prev_gain) / prev_gain * 100.0
-            else:
-                pct_change = None
-        except Exception:
-            pct_change = None
+            WITH g AS (
+                SELECT v.video_id, v.date, v.timestamp, v.views,
+                       COALESCE(v.gain_5min, v.views - COALESCE((
+                           SELECT views FROM views
+                           WHERE video_id = v.video_id AND date = v.date
+                             AND timestamp < v.timestamp
+                           ORDER BY timestamp DESC LIMIT 1), v.views)) AS gain,
+                       COALESCE(v.gain_hourly, v.views - COALESCE((
+                           SELECT views FROM views
+                           WHERE video_id = v.video_id AND date = v.date
+                             AND timestamp <= v.timestamp - interval '1 hour'
+                           ORDER BY timestamp DESC LIMIT 1), v.views)) AS hourly,
+                       p1.views - p0.views AS prev_gain
+                FROM views v
+                LEFT JOIN LATERAL (
+                    SELECT views FROM views
+                    WHERE video_id = v.video_id AND date = v.date - 1
+                      AND timestamp <= v.timestamp - interval '1 day'
+                    ORDER BY timestamp DESC LIMIT 1
+                ) p1 ON true
+                LEFT JOIN LATERAL (
+                    SELECT views FROM views
+                    WHERE video_id = v.video_id AND date = v.date - 1
+                      AND timestamp <= v.timestamp - interval '1 day 5 minutes'
+                    ORDER BY timestamp DESC LIMIT 1
+                ) p0 ON true
+            )
+            SELECT vl.video_id, vl.name, vl.is_tracking, g.date,
+                   to_char(g.timestamp, 'YYYY-MM-DD HH24:MI:SS') AS ts, g.views, g.gain, g.hourly,
+                   CASE WHEN g.prev_gain <> 0
+                        THEN (g.gain - g.prev_gain) * 100.0 / g.prev_gain END::float8 AS pct_change
+            FROM video_list vl
+            LEFT JOIN g USING (video_id)
+            ORDER BY vl.name, vl.video_id, g.date DESC, g.timestamp ASC
+        """)
+        for vid, video_rows in groupby(cur, key=itemgetter("video_id")):
+            video_rows = list(video_rows)
+            daily = {
+                d: [(r["ts"], r["views"], r["gain"], r["hourly"], r["pct_change"]) for r in day_rows]
+                for d, day_rows in groupby(video_rows, key=itemgetter("date"))
+                if d is not None
+            }
+            # Chart series per day, newest first like the table, emitted by the
+            # template as one JSON island
+            charts = {}
+            for d, rows in daily.items():
+                labels, views, gains, hourly, _ = zip(*reversed(rows))
+                charts[d] = {"labels": labels, "views": views, "gain": gains, "hourly": hourly}
+            videos.append({
+                "video_id": vid,
+                "name": video_rows[0]["name"],
+                "daily_data": daily,
+                "charts": charts,
+                "is_tracking": bool(video_rows[0]["is_tracking"])
+            })
+    return videos
 
-        result.append((ts, views, gain, hourly, pct_change))
-    return result
+def invalidate_index():
+    with _cache_lock:
+        _index_cache.clear()
+
+def client_has(etag):
+    """If-None-Match check that also accepts the "<etag>:gzip" form Flask-Compress hands out."""
+    tags = request.if_none_match
+    return tags.star_tag or any(t.partition(":")[0] == etag for t in tags.as_set(include_weak=True))
 
 @app.route("/", methods=["GET"])
 def index():
-    videos = []
     try:
-        cur = get_db().cursor()
-        cur.execute("SELECT video_id, name, is_tracking FROM video_list")
-        for row in cur.fetchall():
-            vid = row["video_id"]
-            cur.execute("SELECT DISTINCT date FROM views WHERE video_id=%s ORDER BY date DESC", (vid,))
-            dates = [r["date"] for r in cur.fetchall()]
-            daily = {}
-            for d in dates:
-                cur.execute("SELECT timestamp, views, date FROM views WHERE video_id=%s AND date=%s ORDER BY timestamp ASC", (vid, d))
-                daily[d] = process_gains(vid, cur.fetchall())
-            videos.append({
-                "video_id": vid,
-                "name": row["name"],
-                "daily_data": daily,
-                "is_tracking": bool(row["is_tracking"])
-            })
-        return render_template("index.html", videos=videos)
+        with _cache_lock:
+            cached = _index_cache.get("videos")
+        if cached is None:
+            videos = load_videos()
+            # Content hash, so every worker tags the same data the same way
+            cached = (videos, hashlib.md5(repr(videos).encode()).hexdigest())
+            with _cache_lock:
+                _index_cache["videos"] = cached
+        videos, etag = cached
+        # A pending flash makes this render one-off: never tag or 304 it
+        if "_flashes" in session:
+            return render_template("index.html", videos=videos)
+        if client_has(etag):
+            return "", 304, {"ETag": f'"{etag}"'}
+        resp = make_response(render_template("index.html", videos=videos))
+        resp.set_etag(etag)
+        return resp
     except Exception as e:
-        logger.error(f"Index error: {e}", exc_info=True)
+        logger.error("Index error: %s", e, exc_info=True)
         return render_template("index.html", videos=[], error_message="Loading...")
 
 @app.route("/add_video", methods=["POST"])
@@ -257,54 +509,73 @@ def add_video():
         flash("Can't fetch stats", "error")
         return redirect(url_for("index"))
 
-    cur = get_db().cursor()
-    cur.execute("""
-        INSERT INTO video_list (video_id, name, is_tracking)
-        VALUES (%s, %s, 1)
-        ON CONFLICT (video_id) DO UPDATE SET name=%s, is_tracking=1
-    """, (vid, title, title))
-    safe_store(vid, stats[vid])
+    # One transaction, pipelined: the upsert and first sample travel together
+    # and land in a single commit
+    with get_db_cursor() as cur, cur.connection.transaction(), cur.connection.pipeline():
+        cur.execute("""
+            INSERT INTO video_list (video_id, name, is_tracking)
+            VALUES (%s, %s, 1)
+            ON CONFLICT (video_id) DO UPDATE SET name=%s, is_tracking=1
+        """, (vid, title, title))
+        store_views(cur, {vid: stats[vid]})
+    invalidate_index()
     flash(f"Added: {title}", "success")
     return redirect(url_for("index"))
 
 @app.route("/stop_tracking/<video_id>")
 def toggle(video_id):
-    cur = get_db().cursor()
-    cur.execute("SELECT is_tracking FROM video_list WHERE video_id=%s", (video_id,))
-    cur_state = cur.fetchone()["is_tracking"]
-    new_state = 0 if cur_state else 1
-    cur.execute("UPDATE video_list SET is_tracking=%s WHERE video_id=%s", (new_state, video_id))
+    with get_db_cursor() as cur:
+        cur.execute("SELECT is_tracking FROM video_list WHERE video_id=%s", (video_id,))
+        cur_state = cur.fetchone()["is_tracking"]
+        new_state = 0 if cur_state else 1
+        cur.execute("UPDATE video_list SET is_tracking=%s WHERE video_id=%s", (new_state, video_id))
+    invalidate_index()
     flash("Paused" if new_state == 0 else "Resumed", "success")
     return redirect(url_for("index"))
 
 @app.route("/remove_video/<video_id>")
 def remove(video_id):
-    cur = get_db().cursor()
-    cur.execute("DELETE FROM views WHERE video_id=%s", (video_id,))
-    cur.execute("DELETE FROM video_list WHERE video_id=%s", (video_id,))
+    with get_db_cursor() as cur, cur.connection.transaction():
+        cur.execute("DELETE FROM views WHERE video_id=%s", (video_id,))
+        cur.execute("DELETE FROM video_list WHERE video_id=%s", (video_id,))
+    invalidate_index()
     flash("Video removed", "success")
     return redirect(url_for("index"))
 
 @app.route("/export/<video_id>")
 def export(video_id):
-    cur = get_db().cursor()
-    cur.execute("SELECT name FROM video_list WHERE video_id=%s", (video_id,))
-    row = cur.fetchone()
-    if not row:
-        flash("Not found", "error")
-        return redirect(url_for("index"))
-    name = row["name"]
-    cur.execute("SELECT timestamp, views FROM views WHERE video_id=%s ORDER BY timestamp", (video_id,))
-    df = pd.DataFrame([{"Time": r["timestamp"], "Views": r["views"]} for r in cur.fetchall()])
-    fname = "export.xlsx"
-    df.to_excel(fname, index=False)
-    return send_file(fname, as_attachment=True, download_name=f"{name}_stats.xlsx")
-
-# START
-init_db()
-start_background()
+    with pool.connection() as conn:
+        row = conn.execute("SELECT name FROM video_list WHERE video_id=%s", (video_id,)).fetchone()
+        if not row:
+            flash("Not found", "error")
+            return redirect(url_for("index"))
+        name = row["name"]
+        # Only needed here, so workers that never export don't pay for the import
+        import xlsxwriter
+        # constant_memory flushes each row as it is written instead of holding the sheet
+        buf = io.BytesIO()
+        wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+        ws = wb.add_worksheet()
+        ws.write_row(0, 0, ("Time", "Views"))
+        # Server-side cursor: rows come over in itersize batches, not the whole history at once
+        with conn.transaction(), conn.cursor(name="export_cur") as cur:
+            cur.itersize = 2000
+            cur.execute("""
+                SELECT to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS') AS ts, views
+                FROM views WHERE video_id=%s ORDER BY timestamp
+            """, (video_id,))
+            for i, r in enumerate(cur, start=1):
+                ws.write_row(i, 0, (r["ts"], r["views"]))
+        wb.close()
+    buf.seek(0)
+    return send_file(buf, as_attachment=True, download_name=f"{name}_stats.xlsx",
+                     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
 # RENDER FIX — binds to $PORT automatically
+# Under gunicorn, gunicorn.conf.py runs init_db once in the master (on_starting,
+# via `flask init-db`) and start_background in each worker (post_worker_init)
 if __name__ == "__main__":
+    init_db()
+    start_background()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -1,13 +1,18 @@
 # app_viewer.py
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, request, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
+from cachetools import TTLCache
 from contextlib import contextmanager
-from datetime import datetime, timedelta
-import psycopg
+from itertools import groupby
+from operator import itemgetter
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 import os
+import hashlib
 import logging
-import csv
-import io
+import threading
+import orjson
 
 # === Config ===
 POSTGRES_URL = os.getenv(
@@ -17,130 +22,177 @@ POSTGRES_URL = os.getenv(
     "?sslmode=prefer"
 )
 
+# === JSON: Flask (and |tojson) through orjson, always compact ===
+class ORJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS if kwargs.get("sort_keys", self.sort_keys) else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+Compress(app)
+# orjson serialises the chart data islands (|tojson) several times faster
+app.json = ORJSONProvider(app)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 # === DB ===
+pool = ConnectionPool(
+    POSTGRES_URL,
+    min_size=2,
+    max_size=10,
+    kwargs={
+        "row_factory": dict_row,
+        # Read-only service: no implicit transaction, so returning a connection
+        # to the pool needs no ROLLBACK round trip
+        "autocommit": True,
+        # Dead sockets to the remote DB are noticed and dropped, not handed out
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 5,
+        "options": "-c timezone=Asia/Kolkata",
+    },
+    open=True,
+)
+
 @contextmanager
 def get_db_cursor():
-    conn = psycopg.connect(POSTGRES_URL, row_factory=dict_row)
-    try:
-        yield conn.cursor()
-        conn.commit()
-    except:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
-
-# === In-Memory Gain Calc (4 Columns) ===
-def calc_gains(rows):
-    if not rows:
-        return []
-    out = []
-    for i, row in enumerate(rows):
-        ts, views, date = row["timestamp"], row["views"], row["date"]
-        gain = 0
-        hourly = 0
-        if i > 0 and rows[i-1]["date"] == date:
-            gain = views - rows[i-1]["views"]
-        try:
-            now_dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-            hour_ago = (now_dt - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
-            for prev in reversed(rows[:i]):
-                if prev["date"] != date:
-                    break
-                if prev["timestamp"] <= hour_ago:
-                    hourly = views - prev["views"]
-                    break
-        except:
-            hourly = 0
-        out.append((ts, views, gain, hourly))
-    return out
-
-# === Helper: Convert video data to CSV rows ===
-def video_to_csv_rows(video):
-    rows = []
-    for date, day_data in video["daily_data"].items():
-        for ts, views, gain, hourly in day_data[::-1]:
-            rows.append({
-                "Date": date,
-                "Timestamp (IST)": ts,
-                "Views": views,
-                "View Gain": gain,
-                "Hourly Gain": hourly,
-            })
-    return rows
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
+
+# === Page cache: data only changes on the tracker's 5-minute poll ===
+_page_cache = TTLCache(maxsize=1, ttl=60)
+_page_lock = threading.Lock()
+
+# === Gains (4 Columns) ===
+# gain_5min and gain_hourly are stored per sample by the tracker's views_gains
+# trigger: vs the previous sample, and vs the latest sample at or before one
+# hour earlier, both within the same day (0 when there is none). Rows the
+# tracker hasn't backfilled yet are NULL, so those fall back to the same
+# look-ups (COALESCE only runs them for NULLs).
+GAINS_SQL = """
+    SELECT v.video_id, v.date, v.timestamp, v.views,
+           COALESCE(v.gain_5min, v.views - COALESCE((
+               SELECT views FROM views
+               WHERE video_id = v.video_id AND date = v.date
+                 AND timestamp < v.timestamp
+               ORDER BY timestamp DESC LIMIT 1), v.views)) AS gain,
+           COALESCE(v.gain_hourly, v.views - COALESCE((
+               SELECT views FROM views
+               WHERE video_id = v.video_id AND date = v.date
+                 AND timestamp <= v.timestamp - interval '1 hour'
+               ORDER BY timestamp DESC LIMIT 1), v.views)) AS hourly
+    FROM views v
+"""
+
+# === Helper: Bucket rows (ordered by date DESC, timestamp ASC) per date ===
+def group_daily(rows):
+    return {
+        d: [(r["ts"], r["views"], r["gain"], r["hourly"]) for r in day_rows]
+        for d, day_rows in groupby(rows, key=itemgetter("date"))
+        if d is not None
+    }
+
+# === Helper: Chart series per day (newest first, like the table), emitted as one JSON island ===
+def chart_series(daily):
+    charts = {}
+    for d, rows in daily.items():
+        labels, views, gains, hourly = zip(*reversed(rows))
+        charts[d] = {"labels": labels, "views": views, "gain": gains, "hourly": hourly}
+    return charts
 
 # === Route: Export CSV for a video ===
+# COPY streams the CSV straight from Postgres, newest day first like the page
+EXPORT_SQL = f"""
+    COPY (
+        SELECT date AS "Date",
+               to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS') AS "Timestamp (IST)",
+               views AS "Views", gain AS "View Gain", hourly AS "Hourly Gain"
+        FROM ({GAINS_SQL}) g WHERE video_id=%s
+        ORDER BY date DESC, timestamp DESC
+    ) TO STDOUT WITH (FORMAT csv, HEADER)
+"""
+
+def stream_csv(video_id):
+    with get_db_cursor() as cur:
+        with cur.copy(EXPORT_SQL, (video_id,)) as copy:
+            for block in copy:
+                yield bytes(block)
+
 @app.route("/export/<video_id>")
 def export_csv(video_id):
     try:
         with get_db_cursor() as cur:
             cur.execute("SELECT name FROM video_list WHERE video_id=%s AND is_tracking=1", (video_id,))
             rec = cur.fetchone()
-            if not rec:
-                return "Video not found", 404
-            name = rec["name"]
-
-            cur.execute("SELECT DISTINCT date FROM views WHERE video_id=%s ORDER BY date DESC", (video_id,))
-            dates = [r["date"] for r in cur.fetchall()]
-
-            daily = {}
-            for d in dates:
-                cur.execute("""
-                    SELECT date, timestamp, views
-                    FROM views WHERE video_id=%s AND date=%s
-                    ORDER BY timestamp ASC
-                """, (video_id, d))
-                daily[d] = calc_gains(cur.fetchall())
-
-            video = {"video_id": video_id, "name": name, "daily_data": daily}
     except Exception as e:
-        logging.error(f"Export error: {e}")
+        logging.error("Export error: %s", e)
         return "Service unavailable", 500
-
-    # Generate CSV
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=["Date", "Timestamp (IST)", "Views", "View Gain", "Hourly Gain"])
-    writer.writeheader()
-    for row in video_to_csv_rows(video):
-        writer.writerow(row)
+    if not rec:
+        return "Video not found", 404
+    name = rec["name"]
 
     safe_name = "".join(c if c.isalnum() or c in " _-" else "_" for c in name)
     filename = f"{video_id}_{safe_name}.csv"
 
     return Response(
-        output.getvalue(),
+        stream_with_context(stream_csv(video_id)),
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment;filename={filename}"}
     )
 
+# === Browser caching: the page only changes on the tracker's 5-minute poll ===
+@app.after_request
+def cache_headers(resp):
+    if request.endpoint == "viewer":
+        resp.headers["Cache-Control"] = "private, max-age=30"
+    return resp
+
+# === Helper: If-None-Match, also in the "<etag>:gzip" form Flask-Compress hands out ===
+def client_has(etag):
+    tags = request.if_none_match
+    return tags.star_tag or any(t.partition(":")[0] == etag for t in tags.as_set(include_weak=True))
+
 # === Main Viewer Route ===
 @app.route("/")
 def viewer():
-    videos = []
-    try:
-        with get_db_cursor() as cur:
-            cur.execute("SELECT video_id, name FROM video_list WHERE is_tracking = 1 ORDER BY name")
-            for row in cur.fetchall():
-                vid = row["video_id"]
-                name = row["name"]
-                cur.execute("SELECT DISTINCT date FROM views WHERE video_id=%s ORDER BY date DESC", (vid,))
-                dates = [r["date"] for r in cur.fetchall()]
-                daily = {}
-                for d in dates:
-                    cur.execute("""
-                        SELECT date, timestamp, views
-                        FROM views WHERE video_id=%s AND date=%s
-                        ORDER BY timestamp ASC
-                    """, (vid, d))
-                    daily[d] = calc_gains(cur.fetchall())
-                videos.append({"video_id": vid, "name": name, "daily_data": daily})
-        return render_template("viewer.html", videos=videos)
-    except Exception as e:
-        logging.error(f"Viewer error: {e}")
-        return render_template("viewer.html", videos=[], error_message="Service unavailable.")
+    with _page_lock:
+        page = _page_cache.get("viewer")
+    if page is None:
+        videos = []
+        try:
+            with get_db_cursor() as cur:
+                cur.execute(f"""
+                    SELECT vl.video_id, vl.name, g.date,
+                           to_char(g.timestamp, 'YYYY-MM-DD HH24:MI:SS') AS ts, g.views, g.gain, g.hourly
+                    FROM video_list vl
+                    LEFT JOIN ({GAINS_SQL}) g USING (video_id)
+                    WHERE vl.is_tracking = 1
+                    ORDER BY vl.name, vl.video_id, g.date DESC, g.timestamp ASC
+                """)
+                for vid, video_rows in groupby(cur, key=itemgetter("video_id")):
+                    video_rows = list(video_rows)
+                    daily = group_daily(video_rows)
+                    videos.append({"video_id": vid, "name": video_rows[0]["name"],
+                                   "daily_data": daily, "charts": chart_series(daily)})
+            html = render_template("viewer.html", videos=videos)
+        except Exception as e:
+            logging.error("Viewer error: %s", e)
+            return render_template("viewer.html", videos=[], error_message="Service unavailable.")
+        # Content hash, so every worker hands out the same tag for the same page
+        page = (html, hashlib.md5(html.encode()).hexdigest())
+        with _page_lock:
+            _page_cache["viewer"] = page
+    html, etag = page
+    # Browser already has this page: answer 304 without a body
+    if client_has(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+    resp = Response(html)
+    resp.set_etag(etag)
+    return resp
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
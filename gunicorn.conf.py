@@ -0,0 +1,31 @@
+# gunicorn.conf.py — loaded automatically by `gunicorn app:app`
+import os
+import subprocess
+import sys
+
+# Requests spend their time waiting on Postgres and the YouTube API, so a few
+# threaded workers overlap them; each worker's pool holds up to 10 connections
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = 8
+
+def _serves_tracker(server):
+    # app_viewer has no startup work
+    return server.app.app_uri.partition(":")[0] == "app"
+
+def on_starting(server):
+    # Schema setup and migrations run once, in the master before any worker
+    # forks: no worker timeout can kill them half way, and a failure stops the
+    # deploy instead of being retried by every new worker. A separate process
+    # keeps app.py's pool connections and threads out of the forked workers.
+    if _serves_tracker(server):
+        subprocess.run([sys.executable, "-m", "flask", "--app", "app", "init-db"],
+                       cwd=server.cfg.chdir, check=True)
+
+def post_worker_init(worker):
+    # The poll scheduler runs per worker, after fork; the advisory lock in
+    # app.py keeps that to one poller.
+    tracker = sys.modules.get("app")
+    if tracker is None:
+        return
+    tracker.start_background()
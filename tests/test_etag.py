@@ -0,0 +1,45 @@
+from flask import template_rendered
+
+import app as tracker
+import app_viewer as viewer
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def test_index_gzip_etag_skips_render(monkeypatch):
+    monkeypatch.setattr(tracker, "load_videos", lambda: [])
+    tracker.invalidate_index()
+    client = tracker.app.test_client()
+
+    first = client.get("/", headers=GZIP)
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    etag = first.headers["ETag"]
+    assert etag.endswith(':gzip"')
+
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(template.name)
+
+    with template_rendered.connected_to(record, tracker.app):
+        again = client.get("/", headers={**GZIP, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert rendered == []
+
+
+def test_viewer_gzip_etag_skips_page_response(monkeypatch):
+    monkeypatch.setitem(viewer._page_cache, "viewer", ("<html>" + "x" * 1000 + "</html>", "abc123"))
+    client = viewer.app.test_client()
+
+    first = client.get("/", headers=GZIP)
+    etag = first.headers["ETag"]
+    assert etag == '"abc123:gzip"'
+
+    built = []
+    monkeypatch.setattr(viewer, "Response", lambda *a, **kw: built.append(a))
+    again = client.get("/", headers={**GZIP, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert built == []